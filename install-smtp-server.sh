@@ -127,6 +127,9 @@ log_info "Criando banco de dados SQLite..."
 mkdir -p "$DB_DIR"
 
 cat > "$DB_DIR/schema.sql" << 'EOF'
+-- Permite liberar páginas livres com PRAGMA incremental_vacuum (manutenção do sincronizador)
+PRAGMA auto_vacuum = INCREMENTAL;
+
 -- Tabela de domínios
 CREATE TABLE IF NOT EXISTS tb_mail_domain (
   cd_domain INTEGER PRIMARY KEY AUTOINCREMENT,
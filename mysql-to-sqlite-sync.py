@@ -14,22 +14,34 @@ import logging
 import sys
 import hashlib
 import json
+import os
+import time
 from datetime import datetime
-from typing import Dict, List, Tuple, Any
+from typing import Dict, List, Tuple, Optional, Any
 import argparse
 
-# Configuração de logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/var/log/mysql-sqlite-sync.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+LOG_FILE = '/var/log/mysql-sqlite-sync.log'
+
 logger = logging.getLogger(__name__)
 
 
+def setup_logging(log_file: str = LOG_FILE):
+    """Configura o logging (arquivo de log + stdout)
+    
+    Chamado apenas pelos executáveis: importar este módulo (harness, benchmark)
+    não abre o arquivo de log de produção.
+    """
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        handlers.insert(0, logging.FileHandler(log_file))
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=handlers
+    )
+
+
 class DatabaseConfig:
     """Configurações de banco de dados"""
     
@@ -45,6 +57,156 @@ class DatabaseConfig:
     
     # Tabelas a sincronizar
     TABLES = ['tb_mail_domain', 'tb_mail_mailbox', 'tb_mail_alias']
+    
+    # Manutenção do SQLite (executada ao final de cada ciclo)
+    MAINTENANCE_ENABLED = True
+    WAL_CHECKPOINT_BYTES = 16 * 1024 * 1024
+    FREELIST_VACUUM_RATIO = 0.10
+    CONVERT_AUTO_VACUUM = False
+    INCREMENTAL_VACUUM_PAGES = 256
+    ANALYZE_MIN_CHANGES = 1000
+    PREWARM_INDEXES = True
+    # /run é apagado a cada boot: o prewarm roda apenas na primeira execução após o boot
+    PREWARM_MARKER = '/run/mysql-sqlite-sync/prewarm-done'
+
+
+class SQLiteMaintenance:
+    """Manutenção do banco SQLite: mede antes de agir e registra o tempo de cada etapa"""
+    
+    # Índices usados pelos lookups do Postfix/Dovecot. As páginas das tabelas já são
+    # lidas pelo SELECT * da sincronização; tb_mail_alias.address não tem índice.
+    LOOKUP_INDEXES = [
+        ('tb_mail_domain', 'domain'),
+        ('tb_mail_mailbox', 'username')
+    ]
+    
+    # Pausa entre os lotes do incremental vacuum, para os lookups entrarem entre as transações
+    VACUUM_CHUNK_PAUSE = 0.01
+    
+    def __init__(self, config: DatabaseConfig):
+        self.config = config
+        self.conn = None
+    
+    def run(self, changes: int, conn: Optional[sqlite3.Connection] = None):
+        """Executa todas as etapas de manutenção
+        
+        Sem conn, abre e fecha uma conexão própria. Com conn, usa a conexão informada
+        (ex.: a conexão persistente do socketmap-lookup-server.py) sem fechá-la.
+        """
+        logger.info("=== Manutenção do SQLite ===")
+        
+        if conn is None:
+            self.conn = sqlite3.connect(self.config.SQLITE_PATH, isolation_level=None)
+        else:
+            # Checkpoint e VACUUM não podem rodar dentro de uma transação aberta
+            conn.commit()
+            self.conn = conn
+        try:
+            self.timed('checkpoint WAL', self.checkpoint_wal)
+            self.timed('incremental vacuum', self.incremental_vacuum)
+            self.timed('estatísticas', lambda: self.update_statistics(changes))
+            if self.config.PREWARM_INDEXES and not os.path.exists(self.config.PREWARM_MARKER):
+                # Só marca como feito se o prewarm terminou (ex.: não falhou com "database is locked")
+                if self.timed('prewarm', self.prewarm_indexes):
+                    self.write_prewarm_marker()
+        finally:
+            if conn is None:
+                self.conn.close()
+            self.conn = None
+    
+    def timed(self, step: str, func) -> bool:
+        """Executa uma etapa registrando sua duração; retorna False se a etapa falhou"""
+        start = time.perf_counter()
+        success = True
+        try:
+            func()
+        except sqlite3.Error as e:
+            logger.warning(f"  [MANUTENÇÃO] {step}: falhou - {e}")
+            success = False
+        logger.info(f"  [MANUTENÇÃO] {step}: {(time.perf_counter() - start) * 1000:.1f} ms")
+        return success
+    
+    def pragma(self, name: str) -> Any:
+        """Lê o valor de um PRAGMA"""
+        return self.conn.execute(f"PRAGMA {name}").fetchone()[0]
+    
+    def checkpoint_wal(self):
+        """Faz checkpoint quando o arquivo WAL passa do limite configurado"""
+        if self.pragma('journal_mode') != 'wal':
+            return
+        
+        wal_path = self.config.SQLITE_PATH + '-wal'
+        wal_size = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+        if wal_size < self.config.WAL_CHECKPOINT_BYTES:
+            logger.info(f"  [MANUTENÇÃO] WAL com {wal_size} bytes, checkpoint não necessário")
+            return
+        
+        busy, log_frames, checkpointed = self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        logger.info(f"  [MANUTENÇÃO] Checkpoint WAL ({wal_size} bytes): busy={busy}, frames={log_frames}, checkpointed={checkpointed}")
+    
+    def incremental_vacuum(self):
+        """Libera páginas livres quando passam do limite configurado"""
+        page_count = self.pragma('page_count')
+        freelist_count = self.pragma('freelist_count')
+        ratio = freelist_count / page_count if page_count else 0.0
+        if ratio < self.config.FREELIST_VACUUM_RATIO:
+            logger.info(f"  [MANUTENÇÃO] {freelist_count}/{page_count} páginas livres, vacuum não necessário")
+            return
+        
+        if self.pragma('auto_vacuum') != 2:
+            # Banco criado sem auto_vacuum: a conversão exige um VACUUM completo, que
+            # reescreve o arquivo e bloqueia os lookups do Postfix/Dovecot até terminar
+            if not self.config.CONVERT_AUTO_VACUUM:
+                logger.warning(
+                    f"  [MANUTENÇÃO] {freelist_count}/{page_count} páginas livres, mas o banco não usa "
+                    f"auto_vacuum=INCREMENTAL. Em uma janela de manutenção execute: "
+                    f"sqlite3 {self.config.SQLITE_PATH} 'PRAGMA auto_vacuum = INCREMENTAL; VACUUM;'"
+                )
+                return
+            logger.warning("  [MANUTENÇÃO] Convertendo banco para auto_vacuum=INCREMENTAL (VACUUM completo)")
+            self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self.conn.execute("VACUUM")
+        else:
+            # Lotes limitados: cada lote é uma transação curta, em vez de uma única
+            # transação que bloqueia os lookups enquanto libera todas as páginas
+            chunk = max(1, int(self.config.INCREMENTAL_VACUUM_PAGES))
+            remaining = freelist_count
+            while remaining > 0:
+                # executescript executa o PRAGMA até o fim (execute libera apenas uma página)
+                self.conn.executescript(f"PRAGMA incremental_vacuum({chunk});")
+                current = self.pragma('freelist_count')
+                if current >= remaining:
+                    break
+                remaining = current
+                if remaining > 0:
+                    time.sleep(self.VACUUM_CHUNK_PAUSE)
+        
+        logger.info(f"  [MANUTENÇÃO] Vacuum: {freelist_count} -> {self.pragma('freelist_count')} páginas livres")
+    
+    def update_statistics(self, changes: int):
+        """ANALYZE após grandes volumes de alterações; caso contrário PRAGMA optimize"""
+        if changes >= self.config.ANALYZE_MIN_CHANGES:
+            logger.info(f"  [MANUTENÇÃO] {changes} alterações, executando ANALYZE")
+            self.conn.execute("ANALYZE")
+        else:
+            self.conn.execute("PRAGMA optimize")
+    
+    def prewarm_indexes(self):
+        """Percorre os índices de lookup para carregar suas páginas no cache do SO"""
+        for table, column in self.LOOKUP_INDEXES:
+            # ORDER BY na coluna faz o SQLite percorrer o índice UNIQUE (covering index)
+            self.conn.execute(
+                f"SELECT COUNT(*) FROM (SELECT {column} FROM {table} ORDER BY {column})"
+            ).fetchone()
+    
+    def write_prewarm_marker(self):
+        """Marca o prewarm como feito até o próximo boot"""
+        try:
+            os.makedirs(os.path.dirname(self.config.PREWARM_MARKER), exist_ok=True)
+            with open(self.config.PREWARM_MARKER, 'w') as f:
+                f.write(datetime.now().isoformat())
+        except OSError as e:
+            logger.warning(f"  [MANUTENÇÃO] Não foi possível gravar {self.config.PREWARM_MARKER}: {e}")
 
 
 class MySQLToSQLiteSync:
@@ -60,6 +222,8 @@ class MySQLToSQLiteSync:
             'unchanged': 0,
             'errors': 0
         }
+        # Registros gravados no SQLite neste ciclo: (tabela, registro do MySQL)
+        self.changes = []
     
     def connect_mysql(self) -> pymysql.connections.Connection:
         """Conecta ao banco MySQL"""
@@ -142,6 +306,7 @@ class MySQLToSQLiteSync:
             sqlite_data = self.get_sqlite_data(table, primary_key)
             
             cursor = self.sqlite_conn.cursor()
+            changes = []
             
             for mysql_row in mysql_data:
                 pk_value = mysql_row[primary_key]
@@ -166,6 +331,7 @@ class MySQLToSQLiteSync:
                             )
                         )
                         self.stats['inserted'] += 1
+                        changes.append(mysql_row)
                         logger.info(f"  [INSERT] {table}: cd_domain={pk_value}, domain={mysql_row['domain']}")
                     except Exception as e:
                         logger.error(f"  [ERRO INSERT] {table}: cd_domain={pk_value} - {e}")
@@ -200,6 +366,7 @@ class MySQLToSQLiteSync:
                                 )
                             )
                             self.stats['updated'] += 1
+                            changes.append(mysql_row)
                             logger.info(f"  [UPDATE] {table}: cd_domain={pk_value}, domain={mysql_row['domain']}")
                         except Exception as e:
                             logger.error(f"  [ERRO UPDATE] {table}: cd_domain={pk_value} - {e}")
@@ -208,6 +375,7 @@ class MySQLToSQLiteSync:
                         self.stats['unchanged'] += 1
             
             self.sqlite_conn.commit()
+            self.changes.extend((table, row) for row in changes)
             cursor.close()
             
         except Exception as e:
@@ -228,6 +396,7 @@ class MySQLToSQLiteSync:
             sqlite_data = self.get_sqlite_data(table, primary_key)
             
             cursor = self.sqlite_conn.cursor()
+            changes = []
             
             for mysql_row in mysql_data:
                 pk_value = mysql_row[primary_key]
@@ -253,6 +422,7 @@ class MySQLToSQLiteSync:
                             )
                         )
                         self.stats['inserted'] += 1
+                        changes.append(mysql_row)
                         logger.info(f"  [INSERT] {table}: cd_mailbox={pk_value}, username={mysql_row['username']}")
                     except Exception as e:
                         logger.error(f"  [ERRO INSERT] {table}: cd_mailbox={pk_value} - {e}")
@@ -288,6 +458,7 @@ class MySQLToSQLiteSync:
                                 )
                             )
                             self.stats['updated'] += 1
+                            changes.append(mysql_row)
                             logger.info(f"  [UPDATE] {table}: cd_mailbox={pk_value}, username={mysql_row['username']}")
                         except Exception as e:
                             logger.error(f"  [ERRO UPDATE] {table}: cd_mailbox={pk_value} - {e}")
@@ -296,6 +467,7 @@ class MySQLToSQLiteSync:
                         self.stats['unchanged'] += 1
             
             self.sqlite_conn.commit()
+            self.changes.extend((table, row) for row in changes)
             cursor.close()
             
         except Exception as e:
@@ -322,6 +494,7 @@ class MySQLToSQLiteSync:
                 sqlite_by_address_domain[key] = row
             
             cursor = self.sqlite_conn.cursor()
+            changes = []
             
             for mysql_row in mysql_data:
                 pk_value = mysql_row[primary_key]
@@ -350,6 +523,7 @@ class MySQLToSQLiteSync:
                             )
                         )
                         self.stats['inserted'] += 1
+                        changes.append(mysql_row)
                         logger.info(f"  [INSERT] {table}: cd_alias={pk_value}, address={mysql_row['address']}@{mysql_row['domain']}")
                     except Exception as e:
                         logger.error(f"  [ERRO INSERT] {table}: cd_alias={pk_value}, address={mysql_row['address']}@{mysql_row['domain']} - {e}")
@@ -378,6 +552,9 @@ class MySQLToSQLiteSync:
                             )
                         )
                         self.stats['updated'] += 1
+                        # O cd_alias antigo deixa de existir (registrado como inativo)
+                        changes.append(dict(existing_row, active=0))
+                        changes.append(mysql_row)
                         logger.info(f"  [UPDATE PK] {table}: cd_alias {old_pk}->{pk_value}, address={mysql_row['address']}@{mysql_row['domain']}")
                     except Exception as e:
                         logger.error(f"  [ERRO UPDATE PK] {table}: cd_alias={pk_value} - {e}")
@@ -410,6 +587,7 @@ class MySQLToSQLiteSync:
                                 )
                             )
                             self.stats['updated'] += 1
+                            changes.append(mysql_row)
                             logger.info(f"  [UPDATE] {table}: cd_alias={pk_value}, address={mysql_row['address']}@{mysql_row['domain']}")
                         except Exception as e:
                             logger.error(f"  [ERRO UPDATE] {table}: cd_alias={pk_value} - {e}")
@@ -418,6 +596,7 @@ class MySQLToSQLiteSync:
                         self.stats['unchanged'] += 1
             
             self.sqlite_conn.commit()
+            self.changes.extend((table, row) for row in changes)
             cursor.close()
             
         except Exception as e:
@@ -447,6 +626,13 @@ class MySQLToSQLiteSync:
             self.mysql_conn.close()
             self.sqlite_conn.close()
             
+            # Manutenção do SQLite entre ciclos
+            if self.config.MAINTENANCE_ENABLED:
+                try:
+                    SQLiteMaintenance(self.config).run(self.stats['inserted'] + self.stats['updated'])
+                except Exception as e:
+                    logger.warning(f"Erro na manutenção do SQLite: {e}")
+            
             end_time = datetime.now()
             duration = (end_time - start_time).total_seconds()
             
@@ -492,6 +678,17 @@ def load_config_from_file(config_file: str) -> DatabaseConfig:
         if 'sqlite' in config_data:
             config.SQLITE_PATH = config_data['sqlite'].get('path', config.SQLITE_PATH)
         
+        # Manutenção
+        if 'maintenance' in config_data:
+            config.MAINTENANCE_ENABLED = config_data['maintenance'].get('enabled', config.MAINTENANCE_ENABLED)
+            config.WAL_CHECKPOINT_BYTES = config_data['maintenance'].get('wal_checkpoint_bytes', config.WAL_CHECKPOINT_BYTES)
+            config.FREELIST_VACUUM_RATIO = config_data['maintenance'].get('freelist_vacuum_ratio', config.FREELIST_VACUUM_RATIO)
+            config.CONVERT_AUTO_VACUUM = config_data['maintenance'].get('convert_auto_vacuum', config.CONVERT_AUTO_VACUUM)
+            config.INCREMENTAL_VACUUM_PAGES = config_data['maintenance'].get('incremental_vacuum_pages', config.INCREMENTAL_VACUUM_PAGES)
+            config.ANALYZE_MIN_CHANGES = config_data['maintenance'].get('analyze_min_changes', config.ANALYZE_MIN_CHANGES)
+            config.PREWARM_INDEXES = config_data['maintenance'].get('prewarm_indexes', config.PREWARM_INDEXES)
+            config.PREWARM_MARKER = config_data['maintenance'].get('prewarm_marker', config.PREWARM_MARKER)
+        
         logger.info(f"Configurações carregadas de: {config_file}")
         return config
         
@@ -507,6 +704,8 @@ def load_config_from_file(config_file: str) -> DatabaseConfig:
 
 def main():
     """Função principal"""
+    setup_logging()
+    
     parser = argparse.ArgumentParser(
         description='Sincronização MySQL -> SQLite para servidor de email'
     )
@@ -535,6 +734,11 @@ def main():
         '--sqlite-path',
         help='Caminho do banco SQLite'
     )
+    parser.add_argument(
+        '--no-maintenance',
+        action='store_true',
+        help='Não executar a manutenção do SQLite após a sincronização'
+    )
     
     args = parser.parse_args()
     
@@ -552,6 +756,8 @@ def main():
         config.MYSQL_DATABASE = args.mysql_database
     if args.sqlite_path:
         config.SQLITE_PATH = args.sqlite_path
+    if args.no_maintenance:
+        config.MAINTENANCE_ENABLED = False
     
     # Executar sincronização
     sync = MySQLToSQLiteSync(config)
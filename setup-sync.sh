@@ -112,6 +112,16 @@ if [ ! -f "$CONFIG_FILE" ]; then
     "sqlite": {
         "path": "$SQLITE_PATH"
     },
+    "maintenance": {
+        "enabled": true,
+        "wal_checkpoint_bytes": 16777216,
+        "freelist_vacuum_ratio": 0.10,
+        "convert_auto_vacuum": false,
+        "incremental_vacuum_pages": 256,
+        "analyze_min_changes": 1000,
+        "prewarm_indexes": true,
+        "prewarm_marker": "/run/mysql-sqlite-sync/prewarm-done"
+    },
     "sync": {
         "interval_minutes": 5,
         "log_file": "/var/log/mysql-sqlite-sync.log"
@@ -175,6 +185,8 @@ After=network.target mysql.service
 [Service]
 Type=oneshot
 ExecStart=$VENV_DIR/venv/bin/python $SCRIPT_PATH -c $CONFIG_FILE
+RuntimeDirectory=mysql-sqlite-sync
+RuntimeDirectoryPreserve=yes
 StandardOutput=append:/var/log/mysql-sqlite-sync.log
 StandardError=append:/var/log/mysql-sqlite-sync.log
 
@@ -236,6 +248,42 @@ EOF
     chmod +x /usr/local/bin/check-mail-sync
 fi
 
+# Servidor socketmap (opcional): unit com o Python do venv, onde estão pymysql e tabulate
+if [ -f "socketmap-lookup-server.py" ]; then
+    cp socketmap-lookup-server.py "$VENV_DIR/"
+    chmod +x "$VENV_DIR/socketmap-lookup-server.py"
+    
+    cat > /etc/systemd/system/socketmap-lookup.service << EOF
+[Unit]
+Description=Postfix Socketmap Lookup Service (MySQL -> SQLite Sync)
+After=network.target mysql.service
+Before=postfix.service
+
+[Service]
+Type=simple
+ExecStart=$VENV_DIR/venv/bin/python $VENV_DIR/socketmap-lookup-server.py -c $CONFIG_FILE
+Restart=on-failure
+RestartSec=10
+StandardOutput=append:/var/log/mysql-sqlite-sync.log
+StandardError=append:/var/log/mysql-sqlite-sync.log
+User=root
+Group=root
+ProtectSystem=strict
+RuntimeDirectory=mysql-sqlite-sync
+RuntimeDirectoryPreserve=yes
+ReadWritePaths=/var/log /etc/postfix/db /var/spool/postfix/private
+NoNewPrivileges=true
+
+[Install]
+WantedBy=multi-user.target
+EOF
+    
+    systemctl daemon-reload
+    log_info "Serviço socketmap criado (não habilitado): /etc/systemd/system/socketmap-lookup.service"
+    log_info "Para utilizá-lo, desative o timer/cron de sincronização e execute:"
+    log_info "  systemctl enable --now socketmap-lookup.service"
+fi
+
 # Criar logrotate
 cat > /etc/logrotate.d/mysql-sqlite-sync << 'EOF'
 /var/log/mysql-sqlite-sync.log {
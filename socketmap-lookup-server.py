@@ -0,0 +1,537 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Servidor de Lookup Postfix (socketmap) em Memória
+Responde aos lookups de domínios, mailboxes e aliases a partir de índices hash em memória,
+atualizados a cada ciclo de sincronização MySQL -> SQLite
+Autor: Sistema de Email Marketing
+Data: 2026-10-19
+"""
+
+import sqlite3
+import copy
+import logging
+import sys
+import os
+import json
+import grp
+import random
+import signal
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+import importlib.util
+import multiprocessing
+from typing import Dict, List, Tuple, Optional, Any
+import argparse
+
+# O logging é configurado em main() pelo módulo de sincronização (mesmo arquivo de log)
+logger = logging.getLogger(__name__)
+
+
+# Tamanho máximo de uma requisição socketmap (netstring)
+MAX_REQUEST_SIZE = 10000
+
+# O smtpd roda em chroot (master.cf): no main.cf o socket é referenciado relativo ao
+# queue_directory (socketmap:unix:private/mail-lookup:...), que funciona dentro e fora do chroot
+POSTFIX_QUEUE_DIRECTORY = '/var/spool/postfix'
+DEFAULT_SOCKET = 'private/mail-lookup'
+
+# Consultas do mapa SQLite equivalente (install-smtp-server.sh), usadas no benchmark
+SQLITE_QUERIES = {
+    'domains': "SELECT domain FROM tb_mail_domain WHERE domain='%s' AND active=1",
+    'mailboxes': "SELECT username FROM tb_mail_mailbox WHERE username='%s' AND active=1",
+    'aliases': "SELECT goto FROM tb_mail_alias WHERE address='%s' AND active=1",
+}
+
+
+def load_sync_module():
+    """Carrega mysql-to-sqlite-sync.py como módulo (o nome do arquivo contém hífens)"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mysql-to-sqlite-sync.py')
+    spec = importlib.util.spec_from_file_location('mysql_to_sqlite_sync', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class LookupIndex:
+    """Índice hash em memória: chave de lookup -> tupla de (chave primária, valor)"""
+
+    def __init__(self):
+        self.entries = {}
+        self.key_by_pk = {}
+
+    def apply(self, pk: Any, key: str, value: str, active: bool):
+        """Insere, atualiza ou remove um registro pela chave primária"""
+        old_key = self.key_by_pk.get(pk)
+
+        # As tuplas são substituídas (nunca alteradas), então os lookups
+        # concorrentes sempre enxergam um estado consistente
+        if active:
+            entries = tuple(e for e in self.entries.get(key, ()) if e[0] != pk)
+            self.entries[key] = entries + ((pk, value),)
+            self.key_by_pk[pk] = key
+
+        if old_key is not None and (not active or old_key != key):
+            entries = tuple(e for e in self.entries.get(old_key, ()) if e[0] != pk)
+            if entries:
+                self.entries[old_key] = entries
+            else:
+                self.entries.pop(old_key, None)
+            if not active:
+                self.key_by_pk.pop(pk, None)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Retorna os valores da chave separados por vírgula (como o Postfix junta várias linhas)"""
+        entries = self.entries.get(key)
+        if not entries:
+            return None
+        return ','.join(value for _, value in entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class LookupIndexes:
+    """Índices dos mapas Postfix, alimentados pelo SQLite e pelas alterações da sincronização"""
+
+    # Mapa socketmap -> (tabela, chave primária, coluna da chave, coluna do valor)
+    MAPS = {
+        'domains': ('tb_mail_domain', 'cd_domain', 'domain', 'domain'),
+        'mailboxes': ('tb_mail_mailbox', 'cd_mailbox', 'username', 'username'),
+        'aliases': ('tb_mail_alias', 'cd_alias', 'address', 'goto')
+    }
+
+    def __init__(self):
+        self.indexes = {name: LookupIndex() for name in self.MAPS}
+        self.map_by_table = {table: name for name, (table, _, _, _) in self.MAPS.items()}
+
+    def load_from_sqlite(self, sqlite_path: str):
+        """Carga completa dos registros ativos a partir do SQLite
+        
+        Os novos índices são montados à parte e trocados de uma vez, então os
+        lookups concorrentes nunca enxergam uma carga pela metade.
+        """
+        conn = sqlite3.connect(f'file:{sqlite_path}?mode=ro', uri=True)
+        conn.row_factory = sqlite3.Row
+        indexes = {}
+        try:
+            # Uma única transação de leitura: os três mapas refletem o mesmo estado do banco
+            conn.execute("BEGIN")
+            for name, (table, primary_key, key_column, value_column) in self.MAPS.items():
+                index = LookupIndex()
+                for row in conn.execute(
+                    f"SELECT {primary_key}, {key_column}, {value_column} FROM {table} WHERE active=1"
+                ):
+                    index.apply(row[primary_key], row[key_column], row[value_column], True)
+                indexes[name] = index
+                logger.info(f"Índice {name}: {len(index)} chaves carregadas de {table}")
+        finally:
+            conn.close()
+        self.indexes = indexes
+
+    def apply_changes(self, changes: List[Tuple[str, Dict]]) -> int:
+        """Aplica as alterações de um ciclo de sincronização nos índices; retorna o total aplicado"""
+        applied = 0
+        for table, row in changes:
+            name = self.map_by_table.get(table)
+            if name is None:
+                continue
+            _, primary_key, key_column, value_column = self.MAPS[name]
+            self.indexes[name].apply(
+                row[primary_key],
+                row[key_column],
+                row[value_column],
+                int(row['active']) == 1
+            )
+            applied += 1
+        return applied
+
+    def lookup(self, name: str, key: str) -> Optional[str]:
+        return self.indexes[name].lookup(key)
+
+
+def encode_netstring(data: bytes) -> bytes:
+    """Codifica dados no formato netstring (<tamanho>:<dados>,)"""
+    return str(len(data)).encode() + b':' + data + b','
+
+
+def read_netstring(rfile) -> Optional[bytes]:
+    """Lê uma netstring do stream; retorna None no fim da conexão"""
+    length = b''
+    while True:
+        char = rfile.read(1)
+        if not char:
+            return None
+        if char == b':':
+            break
+        if not char.isdigit() or len(length) > 5:
+            raise ValueError("Netstring inválida")
+        length += char
+
+    size = int(length)
+    if size > MAX_REQUEST_SIZE:
+        raise ValueError(f"Requisição muito grande: {size} bytes")
+
+    data = rfile.read(size)
+    if len(data) != size or rfile.read(1) != b',':
+        raise ValueError("Netstring incompleta")
+    return data
+
+
+class SocketmapHandler(socketserver.StreamRequestHandler):
+    """Atende requisições socketmap do Postfix ("<mapa> <chave>") em uma conexão persistente"""
+
+    def handle(self):
+        indexes = self.server.indexes
+        while True:
+            try:
+                request = read_netstring(self.rfile)
+            except ValueError as e:
+                logger.warning(f"Requisição socketmap inválida: {e}")
+                return
+            if request is None:
+                return
+
+            name, _, key = request.decode('utf-8', errors='replace').partition(' ')
+            if name not in indexes.indexes:
+                reply = f"PERM mapa desconhecido: {name}"
+            else:
+                value = indexes.lookup(name, key)
+                reply = "NOTFOUND " if value is None else f"OK {value}"
+
+            self.wfile.write(encode_netstring(reply.encode('utf-8')))
+            self.wfile.flush()
+
+
+class SocketmapServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Servidor socketmap em socket UNIX local, uma thread por conexão do Postfix"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, indexes: LookupIndexes):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.indexes = indexes
+        super().__init__(socket_path, SocketmapHandler)
+
+        # Permitir acesso ao grupo postfix
+        os.chmod(socket_path, 0o660)
+        try:
+            os.chown(socket_path, -1, grp.getgrnam('postfix').gr_gid)
+        except (KeyError, PermissionError):
+            pass
+
+
+class PersistentConnection:
+    """Proxy de conexão SQLite que sobrevive ao close() do sync_all"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def close(self):
+        pass
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+
+class SocketmapLookupService:
+    """Serviço de lookup: sincroniza periodicamente e mantém os índices em memória atualizados
+    
+    A sincronização do próprio serviço e a manutenção do SQLite (SQLiteMaintenance)
+    gravam pela mesma conexão persistente. Nessa conexão, PRAGMA data_version só muda
+    quando outra conexão grava no banco (smtp-manager.sh, timer/cron de sincronização,
+    sqlite3 manual); nesse caso os índices são recarregados por completo.
+    """
+
+    def __init__(self, sync_module, config, socket_path: str, interval: float,
+                 watch_interval: float, run_sync: bool = True):
+        self.sync_module = sync_module
+        self.config = config
+        self.socket_path = socket_path
+        self.interval = interval
+        self.watch_interval = watch_interval
+        self.run_sync = run_sync
+        self.indexes = LookupIndexes()
+        self.stop_event = threading.Event()
+        self.conn = None
+        self.data_version = None
+
+    def open_connection(self):
+        """Abre a conexão persistente usada pela sincronização e pela detecção de escritas"""
+        conn = sqlite3.connect(self.config.SQLITE_PATH)
+        conn.row_factory = sqlite3.Row
+        self.conn = PersistentConnection(conn)
+
+    def read_data_version(self) -> int:
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def reload_if_changed(self):
+        """Recarrega os índices se outra conexão gravou no SQLite desde a última verificação"""
+        data_version = self.read_data_version()
+        if data_version == self.data_version:
+            return
+
+        start = time.perf_counter()
+        self.data_version = data_version
+        self.indexes.load_from_sqlite(self.config.SQLITE_PATH)
+        logger.info(f"Escrita externa no SQLite detectada: índices recarregados em {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def sync_cycle(self):
+        """Executa um ciclo de sincronização e aplica suas alterações nos índices"""
+        # A manutenção do sync_all abriria outra conexão: ANALYZE/vacuum/checkpoint mudariam o
+        # data_version e forçariam uma recarga completa a cada ciclo. Ela roda abaixo, na conexão persistente.
+        sync_config = copy.copy(self.config)
+        sync_config.MAINTENANCE_ENABLED = False
+        sync = self.sync_module.MySQLToSQLiteSync(sync_config)
+        # As gravações da sincronização usam a conexão persistente e não alteram o data_version
+        sync.connect_sqlite = lambda: self.conn
+        if not sync.sync_all():
+            logger.warning("Ciclo de sincronização com erros; aplicando apenas as alterações gravadas")
+
+        if self.config.MAINTENANCE_ENABLED:
+            try:
+                self.sync_module.SQLiteMaintenance(self.config).run(
+                    sync.stats['inserted'] + sync.stats['updated'], conn=self.conn
+                )
+            except Exception as e:
+                logger.warning(f"Erro na manutenção do SQLite: {e}")
+
+        start = time.perf_counter()
+        applied = self.indexes.apply_changes(sync.changes)
+        logger.info(f"Índices em memória: {applied} alterações aplicadas em {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def run(self):
+        """Carrega os índices, inicia o servidor socketmap e executa os ciclos de sincronização"""
+        # data_version é lido antes da carga: uma escrita entre os dois gera uma recarga extra
+        self.open_connection()
+        self.data_version = self.read_data_version()
+        self.indexes.load_from_sqlite(self.config.SQLITE_PATH)
+
+        server = SocketmapServer(self.socket_path, self.indexes)
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        logger.info(f"Servidor socketmap escutando em {self.socket_path}")
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop_event.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: self.stop_event.set())
+
+        next_sync = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                if self.run_sync and time.monotonic() >= next_sync:
+                    try:
+                        self.sync_cycle()
+                    except Exception as e:
+                        logger.error(f"Erro no ciclo de sincronização: {e}")
+                    next_sync = time.monotonic() + self.interval
+
+                try:
+                    self.reload_if_changed()
+                except sqlite3.Error as e:
+                    logger.error(f"Erro ao verificar alterações no SQLite: {e}")
+
+                self.stop_event.wait(self.watch_interval)
+        finally:
+            server.shutdown()
+            server.server_close()
+            self.conn._conn.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            logger.info("Servidor socketmap encerrado")
+
+
+def socketmap_worker(socket_path: str, keys: List[Tuple[str, str]], duration: float, seed: int, result_queue):
+    """Cliente de benchmark: lookups socketmap sequenciais em uma conexão persistente"""
+    rnd = random.Random(seed)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    rfile = sock.makefile('rb')
+
+    latencies = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        name, key = rnd.choice(keys)
+        start = time.perf_counter()
+        sock.sendall(encode_netstring(f"{name} {key}".encode('utf-8')))
+        read_netstring(rfile)
+        latencies.append(time.perf_counter() - start)
+
+    sock.close()
+    result_queue.put(latencies)
+
+
+def sqlite_worker(sqlite_path: str, keys: List[Tuple[str, str]], duration: float, seed: int, result_queue):
+    """Cliente de benchmark: as mesmas consultas do mapa sqlite: do Postfix"""
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(f'file:{sqlite_path}?mode=ro', uri=True, isolation_level=None)
+
+    latencies = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        name, key = rnd.choice(keys)
+        query = SQLITE_QUERIES[name].replace('%s', key.replace("'", "''"))
+        start = time.perf_counter()
+        conn.execute(query).fetchall()
+        latencies.append(time.perf_counter() - start)
+
+    conn.close()
+    result_queue.put(latencies)
+
+
+def run_benchmark(config, workers: int, duration: float) -> bool:
+    """Compara a vazão de lookups do servidor socketmap com o mapa SQLite"""
+    # Importado aqui: tabulate só é necessário para o relatório do benchmark
+    from tabulate import tabulate
+
+    indexes = LookupIndexes()
+    indexes.load_from_sqlite(config.SQLITE_PATH)
+
+    # Chaves existentes de cada mapa, mais ~10% de chaves inexistentes
+    keys = [(name, key) for name, index in indexes.indexes.items() for key in index.entries]
+    if not keys:
+        logger.error("Nenhum registro ativo no SQLite para o benchmark")
+        return False
+    keys += [
+        (name, f'inexistente{i}@dominio-desconhecido.com')
+        for i in range(max(1, len(keys) // 10))
+        for name in indexes.MAPS
+    ]
+
+    work_dir = tempfile.mkdtemp(prefix='socketmap-bench-')
+    socket_path = os.path.join(work_dir, 'lookup.sock')
+    server = SocketmapServer(socket_path, indexes)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    backends = [
+        ('socketmap', socketmap_worker, socket_path),
+        ('sqlite', sqlite_worker, config.SQLITE_PATH)
+    ]
+
+    rows = []
+    try:
+        for backend, target, path in backends:
+            logger.info(f"Benchmark {backend}: {workers} clientes por {duration:.0f} segundos")
+            result_queue = multiprocessing.Queue()
+            processes = [
+                multiprocessing.Process(target=target, args=(path, keys, duration, i, result_queue))
+                for i in range(workers)
+            ]
+            for process in processes:
+                process.start()
+            latencies = sorted(value for _ in processes for value in result_queue.get())
+            for process in processes:
+                process.join()
+
+            rows.append([
+                backend,
+                len(latencies),
+                f"{len(latencies) / duration:.0f}",
+                f"{latencies[len(latencies) // 2] * 1000:.3f}",
+                f"{latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.3f}",
+            ])
+    finally:
+        server.shutdown()
+        server.server_close()
+        os.unlink(socket_path)
+        os.rmdir(work_dir)
+
+    print(tabulate(
+        rows,
+        headers=["Mapa", "Lookups", "Lookups/s", "p50 ms", "p99 ms"],
+        tablefmt="grid"
+    ))
+    return True
+
+
+def main():
+    """Função principal"""
+    parser = argparse.ArgumentParser(
+        description='Servidor socketmap do Postfix com índices em memória alimentados pela sincronização'
+    )
+    parser.add_argument(
+        '-c', '--config',
+        default='/etc/postfix/db/sync-config.json',
+        help='Arquivo de configuração JSON (padrão: /etc/postfix/db/sync-config.json)'
+    )
+    parser.add_argument(
+        '--socket',
+        help=f'Socket UNIX; caminhos relativos são resolvidos a partir de {POSTFIX_QUEUE_DIRECTORY}, '
+             f'como no main.cf (padrão: {DEFAULT_SOCKET})'
+    )
+    parser.add_argument(
+        '--interval',
+        type=float,
+        help='Intervalo entre ciclos de sincronização em segundos (padrão: 300)'
+    )
+    parser.add_argument(
+        '--watch-interval',
+        type=float,
+        help='Intervalo de verificação de escritas externas no SQLite em segundos (padrão: 5)'
+    )
+    parser.add_argument(
+        '--sqlite-path',
+        help='Caminho do banco SQLite'
+    )
+    parser.add_argument(
+        '--no-sync',
+        action='store_true',
+        help='Apenas servir os lookups, sem executar a sincronização'
+    )
+    parser.add_argument(
+        '--benchmark',
+        action='store_true',
+        help='Compara a vazão de lookups do socketmap com o mapa SQLite e sai'
+    )
+    parser.add_argument(
+        '--benchmark-workers',
+        type=int,
+        default=4,
+        help='Clientes concorrentes do benchmark (padrão: 4)'
+    )
+    parser.add_argument(
+        '--benchmark-duration',
+        type=float,
+        default=10.0,
+        help='Duração de cada benchmark em segundos (padrão: 10)'
+    )
+
+    args = parser.parse_args()
+
+    sync_module = load_sync_module()
+    # O benchmark registra apenas no stdout, sem abrir o log de produção
+    sync_module.setup_logging(None if args.benchmark else sync_module.LOG_FILE)
+    config = sync_module.load_config_from_file(args.config)
+    if args.sqlite_path:
+        config.SQLITE_PATH = args.sqlite_path
+
+    if args.benchmark:
+        sys.exit(0 if run_benchmark(config, args.benchmark_workers, args.benchmark_duration) else 1)
+
+    # Seção "socketmap" do arquivo de configuração
+    socketmap_config = {}
+    try:
+        with open(args.config, 'r') as f:
+            socketmap_config = json.load(f).get('socketmap', {})
+    except (OSError, ValueError):
+        pass
+
+    socket_path = args.socket or socketmap_config.get('socket', DEFAULT_SOCKET)
+    if not os.path.isabs(socket_path):
+        socket_path = os.path.join(POSTFIX_QUEUE_DIRECTORY, socket_path)
+    interval = args.interval if args.interval is not None else socketmap_config.get('interval_seconds', 300)
+    watch_interval = (args.watch_interval if args.watch_interval is not None
+                      else socketmap_config.get('watch_interval_seconds', 5))
+
+    service = SocketmapLookupService(
+        sync_module, config, socket_path, interval, watch_interval, run_sync=not args.no_sync
+    )
+    service.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Harness de Estresse de Latência de Lookups (Postfix/Dovecot)
+Mede a latência das consultas de lookup no SQLite enquanto a sincronização escreve
+Autor: Sistema de Email Marketing
+Data: 2026-10-19
+"""
+
+import sqlite3
+import logging
+import sys
+import os
+import random
+import shutil
+import tempfile
+import time
+import importlib.util
+import multiprocessing
+import queue
+from typing import Dict, List, Any
+import argparse
+from tabulate import tabulate
+
+# Configuração de logging (apenas stdout, para não poluir o log da sincronização)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+# Consultas exatamente como configuradas em install-smtp-server.sh
+LOOKUP_QUERIES = {
+    # sqlite-virtual-mailbox-domains.cf
+    'postfix-domains': "SELECT domain FROM tb_mail_domain WHERE domain='%s' AND active=1",
+    # sqlite-virtual-mailbox-maps.cf
+    'postfix-mailbox': "SELECT username FROM tb_mail_mailbox WHERE username='%s' AND active=1",
+    # sqlite-virtual-alias-maps.cf
+    'postfix-alias': "SELECT goto FROM tb_mail_alias WHERE address='%s' AND active=1",
+    # dovecot-sql.conf.ext (password_query)
+    'dovecot-password': "SELECT username as user, password FROM tb_mail_mailbox WHERE username='%u' AND active=1 AND active_send=1",
+}
+
+# Schema do SQLite (mesmo de install-smtp-server.sh)
+SQLITE_SCHEMA = """
+PRAGMA auto_vacuum = INCREMENTAL;
+
+CREATE TABLE IF NOT EXISTS tb_mail_domain (
+  cd_domain INTEGER PRIMARY KEY AUTOINCREMENT,
+  domain VARCHAR(255) NOT NULL UNIQUE,
+  transport VARCHAR(45) NOT NULL DEFAULT 'virtual',
+  created DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  active INTEGER NOT NULL DEFAULT 1,
+  storage_id INTEGER NOT NULL DEFAULT 1
+);
+
+CREATE TABLE IF NOT EXISTS tb_mail_mailbox (
+  cd_mailbox INTEGER PRIMARY KEY AUTOINCREMENT,
+  username VARCHAR(255) NOT NULL UNIQUE,
+  password VARCHAR(100) NOT NULL,
+  domain VARCHAR(255) NOT NULL,
+  active INTEGER NOT NULL DEFAULT 1,
+  active_send INTEGER NOT NULL DEFAULT 1,
+  storage_id INTEGER NOT NULL DEFAULT 1
+);
+
+CREATE TABLE IF NOT EXISTS tb_mail_alias (
+  cd_alias INTEGER PRIMARY KEY AUTOINCREMENT,
+  address VARCHAR(255) NOT NULL,
+  goto TEXT NOT NULL,
+  domain VARCHAR(255) NOT NULL,
+  active INTEGER NOT NULL DEFAULT 1
+);
+"""
+
+JOURNAL_MODES = ['delete', 'truncate', 'wal']
+
+# Estratégias de aplicação das alterações no SQLite
+APPLY_STRATEGIES = {
+    'por-tabela': 'Commit ao final de cada tabela (comportamento padrão de sync_all)',
+    'ciclo-unico': 'Um único commit ao final do ciclo de sincronização',
+}
+
+
+def load_sync_module():
+    """Carrega mysql-to-sqlite-sync.py como módulo (o nome do arquivo contém hífens)"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mysql-to-sqlite-sync.py')
+    spec = importlib.util.spec_from_file_location('mysql_to_sqlite_sync', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeMySQLCursor:
+    """Cursor mínimo compatível com o uso feito por MySQLToSQLiteSync"""
+
+    def __init__(self, source: 'FakeMySQLSource'):
+        self.source = source
+        self.result = []
+
+    def execute(self, query: str):
+        table = query.split('FROM')[-1].strip()
+        self.result = [dict(row) for row in self.source.tables[table].values()]
+
+    def fetchall(self) -> List[Dict]:
+        return self.result
+
+    def close(self):
+        pass
+
+
+class FakeMySQLSource:
+    """Origem MySQL sintética em memória, com alterações (churn) a cada ciclo"""
+
+    def __init__(self, domains: int, mailboxes: int, aliases: int, seed: int = 0):
+        self.random = random.Random(seed)
+        self.tables = {
+            'tb_mail_domain': {},
+            'tb_mail_mailbox': {},
+            'tb_mail_alias': {}
+        }
+        self.next_pk = {table: 1 for table in self.tables}
+
+        for _ in range(domains):
+            self.add_domain()
+        for _ in range(mailboxes):
+            self.add_mailbox()
+        for _ in range(aliases):
+            self.add_alias()
+
+    def _pk(self, table: str) -> int:
+        pk = self.next_pk[table]
+        self.next_pk[table] += 1
+        return pk
+
+    def _random_domain(self) -> str:
+        return self.random.choice(list(self.tables['tb_mail_domain'].values()))['domain']
+
+    def add_domain(self):
+        pk = self._pk('tb_mail_domain')
+        self.tables['tb_mail_domain'][pk] = {
+            'cd_domain': pk,
+            'domain': f'dominio{pk}.com.br',
+            'transport': 'virtual',
+            'created': '2025-11-19 00:00:00',
+            'active': 1,
+            'storage_id': 1
+        }
+
+    def add_mailbox(self):
+        pk = self._pk('tb_mail_mailbox')
+        domain = self._random_domain()
+        self.tables['tb_mail_mailbox'][pk] = {
+            'cd_mailbox': pk,
+            'username': f'usuario{pk}@{domain}',
+            'password': f'senha{self.random.getrandbits(32):08x}',
+            'domain': domain,
+            'active': 1,
+            'active_send': 1,
+            'storage_id': 1
+        }
+
+    def add_alias(self):
+        pk = self._pk('tb_mail_alias')
+        domain = self._random_domain()
+        mailbox = self.random.choice(list(self.tables['tb_mail_mailbox'].values()))
+        self.tables['tb_mail_alias'][pk] = {
+            'cd_alias': pk,
+            'address': f'alias{pk}@{domain}',
+            'goto': mailbox['username'],
+            'domain': domain,
+            'active': 1
+        }
+
+    def churn(self, rate: float) -> int:
+        """Aplica alterações sintéticas em uma fração dos registros; retorna o total alterado"""
+        changed = 0
+
+        mailboxes = list(self.tables['tb_mail_mailbox'].values())
+        for row in self.random.sample(mailboxes, int(len(mailboxes) * rate)):
+            if self.random.random() < 0.5:
+                row['password'] = f'senha{self.random.getrandbits(32):08x}'
+            else:
+                row['active_send'] = 1 - row['active_send']
+            changed += 1
+
+        aliases = list(self.tables['tb_mail_alias'].values())
+        for row in self.random.sample(aliases, int(len(aliases) * rate)):
+            if self.random.random() < 0.5:
+                row['goto'] = self.random.choice(mailboxes)['username']
+            else:
+                row['active'] = 1 - row['active']
+            changed += 1
+
+        # Novos registros (~10% do volume de alterações)
+        for _ in range(max(1, int(len(mailboxes) * rate * 0.1))):
+            self.add_mailbox()
+            self.add_alias()
+            changed += 2
+
+        return changed
+
+    def lookup_keys(self) -> Dict[str, List[str]]:
+        """Chaves de lookup por consulta, incluindo endereços inexistentes (misses)"""
+        domains = [row['domain'] for row in self.tables['tb_mail_domain'].values()]
+        usernames = [row['username'] for row in self.tables['tb_mail_mailbox'].values()]
+        addresses = [row['address'] for row in self.tables['tb_mail_alias'].values()]
+
+        misses = [f'inexistente{i}@dominio-desconhecido.com' for i in range(max(1, len(usernames) // 10))]
+
+        return {
+            'postfix-domains': domains + ['dominio-desconhecido.com'],
+            'postfix-mailbox': usernames + misses,
+            'postfix-alias': addresses + misses,
+            'dovecot-password': usernames + misses,
+        }
+
+    def cursor(self) -> FakeMySQLCursor:
+        return FakeMySQLCursor(self)
+
+    def close(self):
+        pass
+
+
+class DeferredCommitConnection:
+    """Proxy de conexão SQLite que adia os commits por tabela para o fim do ciclo"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+
+def build_sync_class(sync_module):
+    """Cria uma subclasse de MySQLToSQLiteSync que lê da origem sintética"""
+
+    class HarnessSync(sync_module.MySQLToSQLiteSync):
+        """MySQLToSQLiteSync com origem sintética, journal mode e estratégia configuráveis"""
+
+        def __init__(self, config, source: FakeMySQLSource, journal_mode: str, strategy: str):
+            super().__init__(config)
+            self.source = source
+            self.journal_mode = journal_mode
+            self.strategy = strategy
+
+        def connect_mysql(self):
+            return self.source
+
+        def connect_sqlite(self):
+            conn = super().connect_sqlite()
+            conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            if self.strategy == 'ciclo-unico':
+                return DeferredCommitConnection(conn)
+            return conn
+
+    return HarnessSync
+
+
+def render_query(name: str, key: str) -> str:
+    """Expande %s/%u como o Postfix/Dovecot fazem (com escape de aspas simples)"""
+    quoted = key.replace("'", "''")
+    return LOOKUP_QUERIES[name].replace('%s', quoted).replace('%u', quoted)
+
+
+def reader_worker(db_path: str, keys: Dict[str, List[str]], timeout_ms: int,
+                  seed: int, stop_event, result_queue):
+    """Processo leitor: executa lookups continuamente até o sinal de parada"""
+    rnd = random.Random(seed)
+    names = list(LOOKUP_QUERIES)
+    latencies = {name: [] for name in names}
+    busy = 0
+    errors = 0
+
+    try:
+        # Postfix e Dovecot abrem o banco somente leitura
+        conn = sqlite3.connect(
+            f'file:{db_path}?mode=ro',
+            uri=True,
+            timeout=timeout_ms / 1000.0,
+            isolation_level=None
+        )
+    except Exception as e:
+        result_queue.put({'fatal': f"Leitor não conseguiu abrir o SQLite: {e}"})
+        return
+
+    while not stop_event.is_set():
+        name = rnd.choice(names)
+        query = render_query(name, rnd.choice(keys[name]))
+
+        # Toda tentativa entra na latência: um lookup que espera o busy timeout
+        # e falha é exatamente o atraso que o Postfix/Dovecot sofreria
+        start = time.perf_counter()
+        try:
+            conn.execute(query).fetchall()
+        except sqlite3.Error as e:
+            message = str(e)
+            if 'locked' in message or 'busy' in message:
+                busy += 1
+            else:
+                errors += 1
+        latencies[name].append(time.perf_counter() - start)
+
+    conn.close()
+    result_queue.put({'latencies': latencies, 'busy': busy, 'errors': errors})
+
+
+def collect_results(readers: List[multiprocessing.Process], result_queue) -> List[Dict]:
+    """Aguarda o resultado de cada leitor, sem travar se algum morrer sem responder"""
+    results = []
+    while len(results) < len(readers):
+        try:
+            result = result_queue.get(timeout=1)
+        except queue.Empty:
+            if not any(reader.is_alive() for reader in readers):
+                exitcodes = [reader.exitcode for reader in readers]
+                raise RuntimeError(f"Leitores encerrados sem resultado (exitcodes: {exitcodes})")
+            continue
+        if 'fatal' in result:
+            raise RuntimeError(result['fatal'])
+        results.append(result)
+    return results
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Percentil por posição (nearest-rank) de uma lista já ordenada"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, int(round(pct / 100.0 * len(sorted_values))) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def run_scenario(sync_class, sync_module, args, journal_mode: str, strategy: str) -> Dict:
+    """Executa um cenário (journal mode + estratégia) e retorna as métricas"""
+    work_dir = tempfile.mkdtemp(prefix='lookup-latency-', dir=args.work_dir)
+    db_path = os.path.join(work_dir, 'mailserver.db')
+
+    try:
+        conn = sqlite3.connect(db_path)
+        conn.executescript(SQLITE_SCHEMA)
+        conn.execute(f"PRAGMA journal_mode={journal_mode}")
+        conn.close()
+
+        config = sync_module.DatabaseConfig()
+        config.SQLITE_PATH = db_path
+        config.MAINTENANCE_ENABLED = not args.no_maintenance
+        # Marcador próprio por cenário: não toca o de produção em /run e
+        # todos os cenários pagam o mesmo custo de prewarm
+        config.PREWARM_MARKER = os.path.join(work_dir, 'prewarm-done')
+
+        source = FakeMySQLSource(args.domains, args.mailboxes, args.aliases, seed=args.seed)
+
+        # Carga inicial (não medida)
+        if not sync_class(config, source, journal_mode, strategy).sync_all():
+            raise RuntimeError("Falha na carga inicial do SQLite")
+
+        keys = source.lookup_keys()
+        stop_event = multiprocessing.Event()
+        result_queue = multiprocessing.Queue()
+        readers = [
+            multiprocessing.Process(
+                target=reader_worker,
+                args=(db_path, keys, args.reader_timeout, args.seed + i, stop_event, result_queue)
+            )
+            for i in range(args.readers)
+        ]
+        for reader in readers:
+            reader.start()
+
+        try:
+            # Sincronizações com churn durante a janela de medição
+            cycles = 0
+            changed = 0
+            sync_times = []
+            deadline = time.monotonic() + args.duration
+            while time.monotonic() < deadline:
+                changed += source.churn(args.churn)
+                start = time.perf_counter()
+                if not sync_class(config, source, journal_mode, strategy).sync_all():
+                    logger.warning(f"Ciclo de sincronização com erros ({journal_mode}/{strategy})")
+                sync_times.append(time.perf_counter() - start)
+                cycles += 1
+                time.sleep(args.interval)
+
+            stop_event.set()
+            results = collect_results(readers, result_queue)
+        finally:
+            stop_event.set()
+            for reader in readers:
+                reader.join(timeout=5)
+                if reader.is_alive():
+                    reader.terminate()
+
+        all_latencies = sorted(
+            value
+            for result in results
+            for values in result['latencies'].values()
+            for value in values
+        )
+
+        return {
+            'journal_mode': journal_mode,
+            'strategy': strategy,
+            'lookups': len(all_latencies),
+            'p50': percentile(all_latencies, 50),
+            'p99': percentile(all_latencies, 99),
+            'max': all_latencies[-1] if all_latencies else 0.0,
+            'busy': sum(result['busy'] for result in results),
+            'errors': sum(result['errors'] for result in results),
+            'cycles': cycles,
+            'changed': changed,
+            'sync_avg': sum(sync_times) / len(sync_times) if sync_times else 0.0,
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def parse_list(value: str, allowed: List[str], label: str) -> List[str]:
+    """Valida uma lista separada por vírgulas contra os valores permitidos"""
+    items = [item.strip() for item in value.split(',') if item.strip()]
+    for item in items:
+        if item not in allowed:
+            raise argparse.ArgumentTypeError(f"{label} inválido: {item} (opções: {', '.join(allowed)})")
+    return items
+
+
+def main():
+    """Função principal"""
+    parser = argparse.ArgumentParser(
+        description='Mede a latência dos lookups Postfix/Dovecot no SQLite durante a sincronização'
+    )
+    parser.add_argument(
+        '--journal-modes',
+        default=','.join(JOURNAL_MODES),
+        type=lambda v: parse_list(v, JOURNAL_MODES, 'Journal mode'),
+        help=f'Journal modes a testar (padrão: {",".join(JOURNAL_MODES)})'
+    )
+    parser.add_argument(
+        '--strategies',
+        default=','.join(APPLY_STRATEGIES),
+        type=lambda v: parse_list(v, list(APPLY_STRATEGIES), 'Estratégia'),
+        help=f'Estratégias de aplicação a testar (padrão: {",".join(APPLY_STRATEGIES)})'
+    )
+    parser.add_argument('--readers', type=int, default=8, help='Processos leitores concorrentes (padrão: 8)')
+    parser.add_argument('--duration', type=float, default=10.0, help='Duração de cada cenário em segundos (padrão: 10)')
+    parser.add_argument('--interval', type=float, default=0.0, help='Pausa entre ciclos de sincronização em segundos (padrão: 0)')
+    parser.add_argument('--domains', type=int, default=50, help='Domínios na origem sintética (padrão: 50)')
+    parser.add_argument('--mailboxes', type=int, default=5000, help='Mailboxes na origem sintética (padrão: 5000)')
+    parser.add_argument('--aliases', type=int, default=2000, help='Aliases na origem sintética (padrão: 2000)')
+    parser.add_argument('--churn', type=float, default=0.02, help='Fração de registros alterados por ciclo (padrão: 0.02)')
+    parser.add_argument(
+        '--reader-timeout',
+        type=int,
+        default=0,
+        help='Busy timeout dos leitores em ms; 0 expõe todo SQLITE_BUSY (padrão: 0)'
+    )
+    parser.add_argument('--seed', type=int, default=42, help='Semente dos dados sintéticos (padrão: 42)')
+    parser.add_argument('--work-dir', help='Diretório para os bancos temporários')
+    parser.add_argument('--max-p99-ms', type=float, help='Falha (exit 1) se algum cenário exceder este p99')
+    parser.add_argument('--max-busy', type=int, help='Falha (exit 1) se algum cenário exceder este total de SQLITE_BUSY')
+    parser.add_argument('--no-maintenance', action='store_true', help='Não executar a manutenção do SQLite após cada ciclo')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Exibe o log detalhado da sincronização')
+
+    args = parser.parse_args()
+
+    sync_module = load_sync_module()
+    if not args.verbose:
+        sync_module.logger.setLevel(logging.WARNING)
+    sync_class = build_sync_class(sync_module)
+
+    results = []
+    for journal_mode in args.journal_modes:
+        for strategy in args.strategies:
+            logger.info(f"Executando cenário: journal_mode={journal_mode}, estratégia={strategy}")
+            results.append(run_scenario(sync_class, sync_module, args, journal_mode, strategy))
+
+    rows = [
+        [
+            r['journal_mode'],
+            r['strategy'],
+            r['lookups'],
+            f"{r['p50'] * 1000:.3f}",
+            f"{r['p99'] * 1000:.3f}",
+            f"{r['max'] * 1000:.3f}",
+            r['busy'],
+            r['errors'],
+            r['cycles'],
+            r['changed'],
+            f"{r['sync_avg'] * 1000:.1f}",
+        ]
+        for r in results
+    ]
+    print(tabulate(
+        rows,
+        headers=["Journal", "Estratégia", "Tentativas", "p50 ms", "p99 ms", "max ms",
+                 "SQLITE_BUSY", "Erros", "Ciclos", "Alterações", "Sync médio ms"],
+        tablefmt="grid"
+    ))
+
+    success = True
+    for r in results:
+        if args.max_p99_ms is not None and r['p99'] * 1000 > args.max_p99_ms:
+            logger.error(f"p99 acima do limite em {r['journal_mode']}/{r['strategy']}: {r['p99'] * 1000:.3f} ms")
+            success = False
+        if args.max_busy is not None and r['busy'] > args.max_busy:
+            logger.error(f"SQLITE_BUSY acima do limite em {r['journal_mode']}/{r['strategy']}: {r['busy']}")
+            success = False
+
+    sys.exit(0 if success else 1)
+
+
+if __name__ == '__main__':
+    main()